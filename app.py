@@ -1,72 +1,103 @@
-import numpy as np
-import cv2 # Necesario para el procesamiento de imágenes
+import hashlib
+import multiprocessing
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Antes que cualquier otro import que cargue cv2 (fija el límite de píxeles de OpenCV)
+from image_metrics import (calculate_metrics_from_bytes, init_worker, process_image,
+                           ImagenInvalida, ImagenDemasiadoGrande)
+
+import numpy as np
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
 
 # Importa la lógica separada del sistema difuso
-from fuzzy_system import initialize_fuzzy_system, evaluate_quality 
+from fuzzy_system import initialize_fuzzy_system, evaluate_quality_batch
 
 app = Flask(__name__)
 # Habilitar CORS para permitir llamadas desde el frontend (index.html)
 CORS(app) 
-
-# Carpeta donde se guardarán temporalmente las imágenes subidas
-UPLOAD_FOLDER = 'uploads'
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-# Crear la carpeta si no existe
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
-
-# Inicializar el sistema difuso una sola vez al iniciar el servidor
-CALIDAD_SIMULADOR = None
-try:
-    CALIDAD_SIMULADOR = initialize_fuzzy_system()
-    print("Sistema de Lógica Difusa cargado con éxito.")
-except Exception as e:
-    print(f"Error al inicializar el sistema difuso: {e}")
-
-# --- Funciones de Análisis de Imagen con OpenCV ---
-
-def calculate_metrics(image_path):
+# Tamaño máximo de la petición (Flask responde 413 si se supera)
+app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024
+
+# Con 'spawn', si el servidor se arranca con `python app.py`, multiprocessing vuelve a ejecutar
+# este script en cada worker del pool (como __mp_main__). El worker solo usa image_metrics:
+# ahí no se inicializa el motor ni se crean los pools.
+ES_WORKER_DEL_POOL = __name__ == '__mp_main__'
+
+# Inicializar (compilar) el sistema difuso una sola vez al iniciar el servidor.
+# Además deja el núcleo en la caché de Numba para que los procesos del pool solo lo carguen.
+MOTOR_DIFUSO_LISTO = False
+if not ES_WORKER_DEL_POOL:
+    try:
+        MOTOR_DIFUSO_LISTO = initialize_fuzzy_system()
+        print("Sistema de Lógica Difusa cargado con éxito.")
+    except Exception as e:
+        print(f"Error al inicializar el sistema difuso: {e}")
+
+# Pool de procesos para el análisis: las subidas simultáneas no se serializan en el GIL.
+# Los procesos se crean al llegar la primera petición. Se usa 'spawn' y no 'fork':
+# el proceso principal ya tiene hilos (Flask, OpenCV, Numba) y un fork los dejaría a medias.
+def _crear_executor():
+    return ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=init_worker,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+EXECUTOR = None if ES_WORKER_DEL_POOL else _crear_executor()
+_executor_lock = threading.Lock()
+
+def _procesar_en_pool(buf):
     """
-    Calcula Nitidez, Contraste y Exposición (brillo) de una imagen usando OpenCV.
-    
-    Los resultados se escalan de 0 a 10 para coincidir con el universo de entrada del sistema difuso.
+    Ejecuta process_image(buf) en el pool. Si un worker muere (p. ej. lo mata el OOM killer),
+    el pool queda inservible: se sustituye por uno nuevo para las peticiones siguientes y
+    el error se propaga a la petición actual.
     """
-    # Leer la imagen en escala de grises para cálculos de nitidez y contraste
-    img_gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    # Leer la imagen a color para el cálculo de brillo/exposición
-    img_bgr = cv2.imread(image_path)
-    
-    if img_gray is None:
-        raise FileNotFoundError(f"No se pudo cargar la imagen en: {image_path}")
-
-    # 1. NITIDEZ (Sharpness) - Se usa la Varianza del Laplaciano
-    # Mayor varianza = Mayor nitidez
-    laplacian_variance = cv2.Laplacian(img_gray, cv2.CV_64F).var()
-    # Los valores típicos de nitidez varían, se necesita un mapeo:
-    # 0 (desenfocado) a 1000+ (muy nítido). Usamos un mapeo logarítmico para comprimir.
-    nitidez_val = np.log1p(laplacian_variance) * (10 / np.log1p(300)) # Escala aproximada a 0-10
-    nitidez_val = np.clip(nitidez_val, 0, 10) # Limitar a [0, 10]
-    
-    # 2. CONTRASTE (Contrast) - Se usa la desviación estándar de la intensidad
-    # Mayor desviación estándar = Mayor contraste
-    contrast_std = np.std(img_gray)
-    # Rango de 0 a 255. 
-    contraste_val = (contrast_std / 50) * 10 # Escala: 50 es un buen punto medio.
-    contraste_val = np.clip(contraste_val, 0, 10)
-
-    # 3. EXPOSICIÓN (Exposure/Brightness) - Se usa el valor medio de los píxeles
-    # Convertir a HSV y usar el canal V (Value/Brillo)
-    img_hsv = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV)
-    mean_value = np.mean(img_hsv[:,:,2])
-    # Rango de 0 a 255. Un valor de 127 es 'correcta' (5.0 en el sistema difuso)
-    # Se ajusta para que el valor 127 sea el centro (5.0) y 255 sea el máximo (10.0)
-    exposicion_val = (mean_value / 255) * 10 
-    
-    return float(nitidez_val), float(contraste_val), float(exposicion_val)
+    global EXECUTOR
+    executor = EXECUTOR
+    try:
+        return executor.submit(process_image, buf).result()
+    except BrokenProcessPool:
+        with _executor_lock:
+            # Otro hilo puede haberlo reconstruido ya
+            if EXECUTOR is executor:
+                EXECUTOR = _crear_executor()
+                executor.shutdown(wait=False)
+        raise
+
+# Hilos para decodificar y medir las imágenes de un lote (cv2 libera el GIL en sus llamadas)
+BATCH_EXECUTOR = None if ES_WORKER_DEL_POOL else ThreadPoolExecutor(max_workers=os.cpu_count())
+
+# --- Caché LRU de resultados por contenido de la imagen ---
+# El pipeline es determinista: si se vuelve a subir la misma imagen se devuelve el resultado
+# guardado (calidad, nitidez, contraste, exposicion) sin decodificarla otra vez.
+CACHE_MAX_ENTRADAS = 1024
+_cache_resultados = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _clave_contenido(buf):
+    # blake2b (stdlib) de 128 bits: rápido frente al decode y sin colisiones provocables
+    return hashlib.blake2b(buf, digest_size=16).digest()
+
+def _cache_get(clave):
+    with _cache_lock:
+        resultado = _cache_resultados.get(clave)
+        if resultado is not None:
+            _cache_resultados.move_to_end(clave)
+        return resultado
+
+def _cache_put(clave, resultado):
+    with _cache_lock:
+        _cache_resultados[clave] = resultado
+        _cache_resultados.move_to_end(clave)
+        if len(_cache_resultados) > CACHE_MAX_ENTRADAS:
+            _cache_resultados.popitem(last=False)
+
+@app.errorhandler(413)
+def archivo_demasiado_grande(e):
+    limite_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({'error': f'Archivo demasiado grande (máximo {limite_mb} MB).', 'calidad': 50.0}), 413
 
 @app.route('/upload_and_evaluate', methods=['POST'])
 def upload_and_evaluate_fuzzy_api():
@@ -74,7 +105,7 @@ def upload_and_evaluate_fuzzy_api():
     Endpoint que recibe una imagen subida, calcula sus métricas
     (nitidez, contraste, exposicion) y devuelve la calificación de calidad estética.
     """
-    if CALIDAD_SIMULADOR is None:
+    if not MOTOR_DIFUSO_LISTO:
         return jsonify({'error': 'Motor de Lógica Difusa no disponible.', 'calidad': 50.0}), 503
 
     # Verificar si se subió un archivo
@@ -86,28 +117,36 @@ def upload_and_evaluate_fuzzy_api():
         return jsonify({'error': 'Nombre de archivo vacío.', 'calidad': 50.0}), 400
 
     if file:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
         try:
-            # 1. Guardar la imagen temporalmente
-            file.save(filepath)
-            
-            # 2. Calcular las métricas con OpenCV
-            nitidez_val, contraste_val, exposicion_val = calculate_metrics(filepath)
-
-            # 3. Ejecutar la lógica difusa
-            calidad_final = evaluate_quality(nitidez_val, contraste_val, exposicion_val, CALIDAD_SIMULADOR)
-
-            # 4. Devolver resultado como JSON (y también las métricas calculadas)
+            # 1. Leer la imagen subida en memoria
+            buf = file.read()
+            if not buf:
+                return jsonify({'error': 'Archivo de imagen vacío.', 'calidad': 50.0}), 400
+
+            clave = _clave_contenido(buf)
+            resultado = _cache_get(clave)
+
+            if resultado is None:
+                # 2. Calcular las métricas con OpenCV y 3. ejecutar la lógica difusa (en el pool)
+                resultado = _procesar_en_pool(buf)
+                _cache_put(clave, resultado)
+            calidad_final, nitidez_val, contraste_val, exposicion_val = resultado
+
+            # 4. Devolver resultado como JSON (y también las métricas calculadas, sin redondear:
+            # el frontend les da formato con toFixed)
             return jsonify({
                 'calidad': calidad_final,
-                'nitidez_calc': round(nitidez_val, 2),
-                'contraste_calc': round(contraste_val, 2),
-                'exposicion_calc': round(exposicion_val, 2),
+                'nitidez_calc': nitidez_val,
+                'contraste_calc': contraste_val,
+                'exposicion_calc': exposicion_val,
                 'status': 'success'
             })
 
+        except ImagenDemasiadoGrande as e:
+            return jsonify({'error': str(e), 'calidad': 50.0, 'status': 'error'}), 413
+        except ImagenInvalida as e:
+            # Imagen no decodificable: error del cliente, no del servidor
+            return jsonify({'error': str(e), 'calidad': 50.0, 'status': 'error'}), 400
         except Exception as e:
             print(f"Error procesando la solicitud: {e}")
             return jsonify({
@@ -115,10 +154,91 @@ def upload_and_evaluate_fuzzy_api():
                 'error': f'Error interno: {str(e)}',
                 'status': 'error'
             }), 500
-        finally:
-            # 5. Limpiar: Eliminar el archivo temporal
-            if os.path.exists(filepath):
-                os.remove(filepath)
+
+def _metricas_o_error(buf):
+    """
+    calculate_metrics_from_bytes(buf) sin propagar el error: devuelve (métricas, None)
+    o (None, mensaje), para que una imagen defectuosa no haga fallar todo el lote.
+    """
+    try:
+        return calculate_metrics_from_bytes(buf), None
+    except Exception as e:
+        return None, str(e)
+
+@app.route('/batch_evaluate', methods=['POST'])
+def batch_evaluate_fuzzy_api():
+    """
+    Endpoint que recibe varias imágenes (campo 'imageFiles') y devuelve la calificación
+    de calidad estética de cada una. La lógica difusa se evalúa en lote sobre un array (N, 3).
+    Una imagen que no se puede procesar da una entrada con 'status': 'error' en su posición.
+    """
+    if not MOTOR_DIFUSO_LISTO:
+        return jsonify({'error': 'Motor de Lógica Difusa no disponible.', 'resultados': []}), 503
+
+    files = [f for f in request.files.getlist('imageFiles') if f.filename != '']
+    if not files:
+        return jsonify({'error': 'No se encontraron archivos de imagen.', 'resultados': []}), 400
+
+    try:
+        # 1. Leer las imágenes en memoria; las ya evaluadas salen de la caché
+        bufs = [f.read() for f in files]
+        claves = [_clave_contenido(buf) for buf in bufs]
+        resultados = [_cache_get(clave) for clave in claves]
+        pendientes = [i for i, resultado in enumerate(resultados) if resultado is None]
+        errores = {}
+
+        if pendientes:
+            # 2. Calcular las métricas de las pendientes en paralelo; las que fallan se apartan
+            validas = []
+            metricas = []
+            for i, (metricas_i, error) in zip(pendientes, BATCH_EXECUTOR.map(_metricas_o_error,
+                                                                             [bufs[i] for i in pendientes])):
+                if error is None:
+                    validas.append(i)
+                    metricas.append(metricas_i)
+                else:
+                    errores[i] = error
+
+            # 3. Ejecutar la lógica difusa para todo el lote válido
+            if validas:
+                metricas = np.array(metricas)
+                calidades = evaluate_quality_batch(metricas)
+                for i, calidad, (nitidez_val, contraste_val, exposicion_val) in zip(validas, calidades, metricas):
+                    resultados[i] = (float(calidad), float(nitidez_val), float(contraste_val), float(exposicion_val))
+                    _cache_put(claves[i], resultados[i])
+
+        # 4. Devolver un resultado por imagen, en el mismo orden en que se subieron
+        salida = []
+        for i, f in enumerate(files):
+            if i in errores:
+                salida.append({
+                    'archivo': f.filename,
+                    'calidad': 50.0,
+                    'error': errores[i],
+                    'status': 'error',
+                })
+            else:
+                calidad, nitidez_val, contraste_val, exposicion_val = resultados[i]
+                salida.append({
+                    'archivo': f.filename,
+                    'calidad': calidad,
+                    'nitidez_calc': nitidez_val,
+                    'contraste_calc': contraste_val,
+                    'exposicion_calc': exposicion_val,
+                    'status': 'success',
+                })
+        return jsonify({
+            'resultados': salida,
+            'status': 'success'
+        })
+
+    except Exception as e:
+        print(f"Error procesando el lote: {e}")
+        return jsonify({
+            'resultados': [],
+            'error': f'Error interno: {str(e)}',
+            'status': 'error'
+        }), 500
 
 if __name__ == '__main__':
     print("Iniciando servidor de Lógica Difusa en http://127.0.0.1:5000")
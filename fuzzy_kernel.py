@@ -0,0 +1,96 @@
+import numpy as np
+from numba import njit
+
+# --- Núcleo Mamdani compilado con Numba ---
+# Réplica del sistema definido en fuzzy_system.construir_simulador_referencia(),
+# sin pasar por el grafo de reglas de scikit-fuzzy. Los puntos de entrada liberan el GIL
+# (nogil=True) y quedan en la caché de disco de Numba (cache=True) tras la primera compilación.
+# evaluate_batch() es un bucle secuencial: con lotes de decenas de imágenes, parallel=True
+# costaba más en lanzar hilos que en evaluar (y su capa workqueue no admite hilos concurrentes).
+
+# Las MFs de salida (0 a 100) solo se solapan de dos en dos, y min() de cada par
+# de flancos es un triángulo de altura 0.4:
+#   pobre [0, 0, 30, 50] y aceptable [30, 60, 90]     -> triángulo [30, 42, 50]
+#   aceptable [30, 60, 90] y excelente [70, 90, 100, 100] -> triángulo [70, 78, 90]
+ALTURA_SOLAPE = 0.4
+
+@njit(cache=True, fastmath=True)
+def _trimf(x, a, b, c):
+    # Triangular; admite hombros (a == b o b == c) sin dividir por cero
+    if x < a or x > c:
+        return 0.0
+    if x < b:
+        return (x - a) / (b - a)
+    if x > b:
+        return (c - x) / (c - b)
+    return 1.0
+
+@njit(cache=True, fastmath=True)
+def _recorte(a, b, c, d, h):
+    """
+    Área y primer momento de la MF trapezoidal [a, b, c, d] (altura 1) recortada a la altura h.
+    """
+    x1 = a + (b - a) * h
+    x2 = d - (d - c) * h
+    area_izq = 0.5 * h * (x1 - a)
+    area_centro = h * (x2 - x1)
+    area_der = 0.5 * h * (d - x2)
+    area = area_izq + area_centro + area_der
+    momento = (area_izq * (a + 2.0 * x1) / 3.0
+               + area_centro * (x1 + x2) / 2.0
+               + area_der * (2.0 * x2 + d) / 3.0)
+    return area, momento
+
+@njit(cache=True, fastmath=True, nogil=True)
+def evaluate(n, c, e):
+    """
+    Calidad estética (0-100) para nitidez n, contraste c y exposición e en [0, 10].
+    """
+    n = min(max(n, 0.0), 10.0)
+    c = min(max(c, 0.0), 10.0)
+    e = min(max(e, 0.0), 10.0)
+
+    # Funciones de Pertenencia de las entradas
+    n_baja, n_media, n_alta = _trimf(n, 0, 0, 5), _trimf(n, 0, 5, 10), _trimf(n, 5, 10, 10)
+    c_bajo, c_normal, c_alto = _trimf(c, 0, 0, 5), _trimf(c, 0, 5, 10), _trimf(c, 5, 10, 10)
+    e_oscura, e_correcta, e_brillante = _trimf(e, 0, 0, 5), _trimf(e, 0, 5, 10), _trimf(e, 5, 10, 10)
+
+    # Reglas de Inferencia (AND = min, OR = max), agregadas por término de salida con max
+    alfa_pobre = max(
+        max(n_baja, c_bajo),                 # rule1
+        max(e_oscura, e_brillante),          # rule3
+        min(n_baja, e_oscura),               # rule7
+        min(c_alto, e_brillante),            # rule8
+    )
+    alfa_aceptable = max(
+        min(n_media, c_normal, e_correcta),  # rule4
+        max(n_media, c_normal),              # rule6
+    )
+    alfa_excelente = max(
+        min(n_alta, c_alto),                 # rule2
+        min(n_alta, c_normal, e_correcta),   # rule5
+    )
+
+    # Centroide exacto de la agregación max(): max(f, g) = f + g - min(f, g)
+    area_p, momento_p = _recorte(0, 0, 30, 50, alfa_pobre)
+    area_a, momento_a = _recorte(30, 60, 60, 90, alfa_aceptable)
+    area_e, momento_e = _recorte(70, 90, 100, 100, alfa_excelente)
+    h_pa = min(min(alfa_pobre, alfa_aceptable) / ALTURA_SOLAPE, 1.0)
+    h_ae = min(min(alfa_aceptable, alfa_excelente) / ALTURA_SOLAPE, 1.0)
+    area_pa, momento_pa = _recorte(30, 42, 42, 50, h_pa)
+    area_ae, momento_ae = _recorte(70, 78, 78, 90, h_ae)
+
+    area = area_p + area_a + area_e - ALTURA_SOLAPE * (area_pa + area_ae)
+    momento = momento_p + momento_a + momento_e - ALTURA_SOLAPE * (momento_pa + momento_ae)
+
+    return momento / max(area, 1e-12)
+
+@njit(cache=True, fastmath=True, nogil=True)
+def evaluate_batch(metricas):
+    """
+    evaluate() para cada fila (nitidez, contraste, exposición) de un array (N, 3).
+    """
+    resultado = np.empty(metricas.shape[0])
+    for i in range(metricas.shape[0]):
+        resultado[i] = evaluate(metricas[i, 0], metricas[i, 1], metricas[i, 2])
+    return resultado
@@ -1,13 +1,21 @@
 import numpy as np
-import skfuzzy as fuzz
-from skfuzzy import control as ctrl
+
+from fuzzy_kernel import evaluate as evaluar_kernel
+from fuzzy_kernel import evaluate_batch as evaluar_kernel_lote
 
 # --- Definición del Sistema Difuso (Mamdani) ---
 
-def initialize_fuzzy_system():
-    # Universos del Discurso
-    universo_entrada = np.arange(0, 10.1, 0.1)
-    universo_salida = np.arange(0, 100.1, 1)
+def construir_simulador_referencia():
+    """
+    Sistema difuso original en scikit-fuzzy. Ya no se usa en las peticiones:
+    sirve como referencia para validar fuzzy_kernel.evaluate().
+    """
+    import skfuzzy as fuzz
+    from skfuzzy import control as ctrl
+
+    # Universos del Discurso (linspace fija los 101 puntos y los extremos exactos; float32 basta)
+    universo_entrada = np.linspace(0.0, 10.0, 101, dtype=np.float32)
+    universo_salida = np.linspace(0.0, 100.0, 101, dtype=np.float32)
 
     # Antecedentes (Entradas)
     nitidez = ctrl.Antecedent(universo_entrada, 'nitidez')
@@ -48,18 +56,71 @@ def initialize_fuzzy_system():
     # Sistema de Control y Simulación (Se usa para evaluar los inputs)
     calidad_ctrl = ctrl.ControlSystem([rule1, rule2, rule3, rule4, rule5, rule6, rule7, rule8])
     calidad_simulador = ctrl.ControlSystemSimulation(calidad_ctrl)
-    
+
     return calidad_simulador
 
-def evaluate_quality(nitidez_val, contraste_val, exposicion_val, simulador):
+def initialize_fuzzy_system():
+    """
+    Compila (o carga de la caché de Numba) el núcleo difuso con una evaluación de prueba.
+
+    El núcleo no guarda estado entre llamadas, así que una sola versión compilada
+    se comparte entre todos los hilos sin locks ni un simulador por hilo.
+    """
+    evaluar_kernel(5.0, 5.0, 5.0)
+    evaluar_kernel_lote(np.full((1, 3), 5.0))
+    return True
+
+def evaluate_quality(nitidez_val, contraste_val, exposicion_val):
     """
     Ejecuta el sistema difuso con los valores de entrada.
     """
-    simulador.input['nitidez'] = nitidez_val
-    simulador.input['contraste'] = contraste_val
-    simulador.input['exposicion'] = exposicion_val
-    
-    simulador.compute()
-    calidad_final = simulador.output['calidad_estetica']
-    
-    return float(calidad_final)
\ No newline at end of file
+    # Siempre float: así se usa la especialización ya compilada en initialize_fuzzy_system()
+    # y un int o np.float32 no dispara una compilación nueva en mitad de una petición.
+    return float(evaluar_kernel(float(nitidez_val), float(contraste_val), float(exposicion_val)))
+
+def evaluate_quality_batch(metricas):
+    """
+    Ejecuta el sistema difuso para N imágenes a la vez.
+    metricas: array (N, 3) con las columnas nitidez, contraste y exposición.
+    """
+    metricas = np.ascontiguousarray(metricas, dtype=np.float64).reshape(-1, 3)
+    return evaluar_kernel_lote(metricas)
+
+# Tolerancia de la validación frente a scikit-fuzzy (escala 0-100).
+# La diferencia es error de discretización de la referencia, no del núcleo: scikit-fuzzy calcula
+# el centroide sobre los 101 puntos del universo de salida y se aleja del centroide exacto hasta
+# ~0.01 (con 1001 puntos baja a ~5e-5). 0.05 deja margen para cualquier muestra de entradas.
+TOLERANCIA_REFERENCIA = 0.05
+
+if __name__ == '__main__':
+    # Validación: compara el núcleo compilado con el simulador de scikit-fuzzy.
+    # Falla (AssertionError) si el centroide cerrado de fuzzy_kernel se desvía de la referencia.
+    simulador = construir_simulador_referencia()
+    rng = np.random.default_rng(0)
+    # Puntos aleatorios, la rejilla de los vértices de las MFs (0, 2.5, 5, 7.5, 10)
+    # y puntos a ±0.001 de esos vértices y de los bordes 0/10
+    vertices = np.linspace(0, 10, 5)
+    rejilla = np.stack(np.meshgrid(vertices, vertices, vertices), axis=-1).reshape(-1, 3)
+    cerca_vertices = np.clip(np.concatenate([vertices - 1e-3, vertices + 1e-3]), 0, 10)
+    puntos = np.vstack([rng.uniform(0, 10, size=(500, 3)), rejilla,
+                        rng.choice(cerca_vertices, size=(200, 3))])
+
+    error_max = 0.0
+    for n, c, e in puntos:
+        simulador.input['nitidez'] = n
+        simulador.input['contraste'] = c
+        simulador.input['exposicion'] = e
+        simulador.compute()
+        error = abs(simulador.output['calidad_estetica'] - evaluate_quality(n, c, e))
+        error_max = max(error_max, error)
+    print(f"Diferencia máxima con scikit-fuzzy: {error_max:.4f}")
+    assert error_max < TOLERANCIA_REFERENCIA, (
+        f"fuzzy_kernel se desvía de scikit-fuzzy en {error_max:.4f} (tolerancia {TOLERANCIA_REFERENCIA})")
+
+    # El lote debe dar exactamente lo mismo que la evaluación individual
+    individual = np.array([evaluate_quality(n, c, e) for n, c, e in puntos])
+    error_lote = np.abs(evaluate_quality_batch(puntos) - individual).max()
+    print(f"Diferencia máxima lote vs. individual: {error_lote:.2e}")
+    assert error_lote == 0.0, f"evaluate_quality_batch difiere de evaluate_quality en {error_lote:.2e}"
+
+    print("Validación correcta.")
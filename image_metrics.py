@@ -0,0 +1,228 @@
+import math
+import os
+
+# Límite de píxeles que OpenCV acepta al decodificar. OpenCV lo lee al cargarse, por eso va
+# antes de importar cv2 (y app.py importa este módulo antes que cualquier otro que use cv2).
+# Evita que una imagen pequeña en bytes pero enorme en píxeles agote la memoria de un worker.
+MAX_PIXELES = 64 * 1024 * 1024
+os.environ.setdefault('OPENCV_IO_MAX_IMAGE_PIXELS', str(MAX_PIXELES))
+
+import numpy as np
+import cv2 # Necesario para el procesamiento de imágenes
+
+from fuzzy_system import initialize_fuzzy_system, evaluate_quality
+
+# Análisis de imagen sin efectos secundarios al importarse: es lo único que cargan los
+# procesos del pool (app.py crea Flask, los pools y la caché; aquí no se crea nada).
+
+# Lado corto máximo (en píxeles) con el que se calculan contraste y exposición.
+# Son estadísticas globales: reducir imágenes grandes apenas cambia su valor.
+# La nitidez NO: la varianza del Laplaciano depende de la resolución (al reducir, el
+# desenfoque encoge y una foto borrosa parece nítida), así que se mide a resolución completa.
+LADO_CORTO_MAX = 512
+
+# Factores de escala a 0-10 de las métricas (precalculados: se usan en cada petición)
+ESCALA_NITIDEZ = 10.0 / math.log1p(300.0)  # log1p(varianza del Laplaciano) -> 0-10
+ESCALA_CONTRASTE = 10.0 / 50.0             # Escala: 50 es un buen punto medio.
+
+# --- Funciones de Análisis de Imagen con OpenCV ---
+
+class ImagenInvalida(ValueError):
+    """
+    La imagen subida no se puede analizar (vacía o no decodificable): error del cliente.
+    """
+
+class ImagenDemasiadoGrande(ImagenInvalida):
+    """
+    La imagen supera MAX_PIXELES al decodificarla.
+    """
+
+def calculate_metrics_from_bytes(buf):
+    """
+    Calcula Nitidez, Contraste y Exposición (brillo) de una imagen (bytes del archivo) usando OpenCV.
+    
+    Los resultados se escalan de 0 a 10 para coincidir con el universo de entrada del sistema difuso.
+    """
+    if not buf:
+        raise ImagenInvalida("El archivo de imagen está vacío.")
+
+    # Decodificar la imagen en memoria una sola vez, a color (sin pasar por disco)
+    try:
+        img_bgr = cv2.imdecode(np.frombuffer(buf, np.uint8), cv2.IMREAD_COLOR)
+    except cv2.error as e:
+        # imdecode lanza (en vez de devolver None) si la imagen supera MAX_PIXELES;
+        # cualquier otro error de OpenCV se propaga tal cual
+        if 'CV_IO_MAX_IMAGE_PIXELS' not in str(e):
+            raise
+        raise ImagenDemasiadoGrande(f"La imagen supera el máximo de {MAX_PIXELES} píxeles.")
+    
+    if img_bgr is None:
+        raise ImagenInvalida("No se pudo decodificar la imagen subida.")
+
+    # Escala de grises (derivada del mismo buffer) para cálculos de nitidez y contraste
+    img_gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+
+    # Reducir imágenes grandes para contraste y exposición (INTER_AREA evita aliasing).
+    # La BGR se reduce ya: a partir de aquí solo la gris sigue a resolución completa.
+    alto, ancho = img_gray.shape
+    escala = LADO_CORTO_MAX / min(alto, ancho)
+    if escala < 1:
+        img_bgr = cv2.resize(img_bgr, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA)
+
+    # 1. NITIDEZ (Sharpness) - Se usa la Varianza del Laplaciano
+    # Mayor varianza = Mayor nitidez
+    # Con entrada de 8 bits el Laplaciano (ksize=1) está en ±1020: cabe en CV_16S,
+    # que mueve 4 veces menos memoria que CV_64F.
+    # cv2.meanStdDev calcula media y desviación en una sola pasada de OpenCV
+    laplacian = cv2.Laplacian(img_gray, cv2.CV_16S, ksize=1)
+    _, laplacian_std = cv2.meanStdDev(laplacian)
+    laplacian_variance = float(laplacian_std[0, 0]) ** 2
+    del laplacian # Liberar cada buffer tras su último uso: baja el pico de memoria por petición
+    # Los valores típicos de nitidez varían, se necesita un mapeo:
+    # 0 (desenfocado) a 1000+ (muy nítido). Usamos un mapeo logarítmico para comprimir.
+    # Escalares de Python con math: evita el coste de llamar a ufuncs de NumPy por valor
+    nitidez_val = min(10.0, math.log1p(laplacian_variance) * ESCALA_NITIDEZ) # Escala aproximada a 0-10, limitada a 10
+
+    if escala < 1:
+        img_gray = cv2.resize(img_gray, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA)
+    
+    # 2. CONTRASTE (Contrast) - Se usa la desviación estándar de la intensidad
+    # Mayor desviación estándar = Mayor contraste
+    _, gray_std = cv2.meanStdDev(img_gray)
+    contrast_std = float(gray_std[0, 0])
+    del img_gray
+    # Rango de 0 a 255. 
+    contraste_val = min(10.0, contrast_std * ESCALA_CONTRASTE)
+
+    # 3. EXPOSICIÓN (Exposure/Brightness) - Se usa el valor medio de los píxeles
+    # Canal V (Value/Brillo) de HSV: V = max(B, G, R). Se calcula con cv2.max sobre los planos,
+    # sin la conversión completa a HSV ni reducciones de NumPy (img_bgr.max(axis=2) es ~20x más lento).
+    img_value = cv2.max(cv2.max(cv2.extractChannel(img_bgr, 0), cv2.extractChannel(img_bgr, 1)),
+                        cv2.extractChannel(img_bgr, 2))
+    del img_bgr
+    mean_value = cv2.mean(img_value)[0]
+    del img_value
+    # Rango de 0 a 255. Un valor de 127 es 'correcta' (5.0 en el sistema difuso)
+    # Se ajusta para que el valor 127 sea el centro (5.0) y 255 sea el máximo (10.0)
+    exposicion_val = (mean_value / 255) * 10
+    
+    return nitidez_val, contraste_val, exposicion_val
+
+def calculate_integrals(img):
+    """
+    Imágenes integrales (suma y suma de cuadrados, float64) de una imagen de un canal,
+    para calcularlas una sola vez y reutilizarlas en varias llamadas a calculate_tile_stats().
+    """
+    return cv2.integral2(img, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+
+def calculate_tile_stats(integrales, tiles):
+    """
+    Media y desviación estándar de cada rectángulo (x0, y0, x1, y1) de una imagen de un canal
+    (x1, y1 exclusivos). Útil para métricas por zonas (p. ej. contraste o varianza del Laplaciano
+    por tile): con las integrales de calculate_integrals(img) cada tile cuesta O(1).
+
+    Lanza ValueError si las coordenadas no son enteras o si algún tile no cumple
+    0 <= x0 < x1 <= ancho y 0 <= y0 < y1 <= alto.
+    Devuelve dos arrays (N,): medias y desviaciones estándar.
+    """
+    suma, suma_cuad = integrales
+    alto, ancho = suma.shape[0] - 1, suma.shape[1] - 1
+    tiles = np.asarray(tiles)
+    # Convertir floats a intp los truncaría en silencio
+    if not np.issubdtype(tiles.dtype, np.integer):
+        raise ValueError(f"Las coordenadas de los tiles deben ser enteras (dtype {tiles.dtype}).")
+    x0, y0, x1, y1 = tiles.astype(np.intp).reshape(-1, 4).T
+
+    # Sin esta comprobación, un índice negativo o fuera de rango daría estadísticas sin sentido
+    # (NumPy indexa desde el final) o un IndexError poco claro
+    validos = (0 <= x0) & (x0 < x1) & (x1 <= ancho) & (0 <= y0) & (y0 < y1) & (y1 <= alto)
+    if not validos.all():
+        i = int(np.argmin(validos))
+        raise ValueError(f"Tile fuera de la imagen ({ancho}x{alto}) o vacío: "
+                         f"({x0[i]}, {y0[i]}, {x1[i]}, {y1[i]}).")
+
+    n = (x1 - x0) * (y1 - y0)
+    s = suma[y1, x1] - suma[y0, x1] - suma[y1, x0] + suma[y0, x0]
+    s_cuad = suma_cuad[y1, x1] - suma_cuad[y0, x1] - suma_cuad[y1, x0] + suma_cuad[y0, x0]
+    media = s / n
+    # max(0, ...) evita varianzas negativas mínimas por redondeo
+    varianza = np.maximum(s_cuad / n - media ** 2, 0.0)
+
+    return media, np.sqrt(varianza)
+
+def init_worker():
+    """
+    Inicializador de cada proceso del pool de app.py: carga el núcleo difuso una vez.
+    """
+    # Ya hay un proceso por CPU: que OpenCV no lance además sus propios hilos en cada uno
+    cv2.setNumThreads(1)
+    initialize_fuzzy_system()
+
+def process_image(buf):
+    """
+    Pipeline completo (OpenCV + lógica difusa) para los bytes de una imagen.
+    Se ejecuta en un proceso del pool, fuera del hilo de la petición.
+    """
+    nitidez_val, contraste_val, exposicion_val = calculate_metrics_from_bytes(buf)
+    calidad_final = evaluate_quality(nitidez_val, contraste_val, exposicion_val)
+    return calidad_final, nitidez_val, contraste_val, exposicion_val
+
+def _imagen_sintetica(sigma_desenfoque, alto=3000, ancho=4000):
+    """
+    PNG sintético de 12 MP (rectángulos aleatorios con semilla fija), opcionalmente desenfocado.
+    """
+    rng = np.random.default_rng(0)
+    img = np.full((alto, ancho, 3), 128, np.uint8)
+    for _ in range(400):
+        x0, y0 = int(rng.integers(0, ancho)), int(rng.integers(0, alto))
+        x1, y1 = x0 + int(rng.integers(20, 600)), y0 + int(rng.integers(20, 600))
+        color = tuple(int(v) for v in rng.integers(0, 256, 3))
+        cv2.rectangle(img, (x0, y0), (x1, y1), color, -1)
+    if sigma_desenfoque:
+        img = cv2.GaussianBlur(img, (0, 0), sigma_desenfoque)
+    return cv2.imencode('.png', img, [cv2.IMWRITE_PNG_COMPRESSION, 1])[1].tobytes()
+
+def validar_metricas():
+    """
+    Comprueba que una foto grande desenfocada sigue midiendo nitidez 'baja' (< 2.5, donde
+    'baja' domina sobre 'media') y que la versión nítida mide claramente más.
+    """
+    nitidez_nitida = calculate_metrics_from_bytes(_imagen_sintetica(0))[0]
+    print(f"Nitidez 12 MP sin desenfoque: {nitidez_nitida:.2f}")
+    assert nitidez_nitida > 5.0, f"La imagen nítida mide nitidez {nitidez_nitida:.2f}"
+    for sigma in (2, 4):
+        nitidez_val = calculate_metrics_from_bytes(_imagen_sintetica(sigma))[0]
+        print(f"Nitidez 12 MP desenfocada (sigma={sigma}): {nitidez_val:.2f}")
+        assert nitidez_val < 2.5, f"Imagen desenfocada (sigma={sigma}) fuera de 'baja': {nitidez_val:.2f}"
+    print("Validación de métricas correcta.")
+
+def validar_tile_stats():
+    """
+    Compara calculate_tile_stats() con NumPy sobre la gris (uint8) y su Laplaciano (CV_16S),
+    y comprueba que los tiles inválidos se rechazan.
+    """
+    rng = np.random.default_rng(0)
+    img_gray = rng.integers(0, 256, (300, 400), dtype=np.uint8)
+    laplacian = cv2.Laplacian(img_gray, cv2.CV_16S, ksize=1)
+    tiles = [(0, 0, 400, 300), (10, 20, 50, 60), (399, 299, 400, 300), (0, 150, 200, 300)]
+    for img in (img_gray, laplacian):
+        medias, desviaciones = calculate_tile_stats(calculate_integrals(img), tiles)
+        for (x0, y0, x1, y1), media, desviacion in zip(tiles, medias, desviaciones):
+            recorte = img[y0:y1, x0:x1].astype(np.float64)
+            assert abs(media - recorte.mean()) < 1e-9, f"Media del tile {(x0, y0, x1, y1)} ({img.dtype})"
+            assert abs(desviacion - recorte.std()) < 1e-6, f"Desviación del tile {(x0, y0, x1, y1)} ({img.dtype})"
+
+    integrales = calculate_integrals(img_gray)
+    for tile in [(-1, 0, 10, 10), (0, 0, 401, 10), (0, 0, 10, 301), (5, 5, 5, 10), (0, 10, 10, 5),
+                 (0.5, 0, 10, 10)]:
+        try:
+            calculate_tile_stats(integrales, [tile])
+        except ValueError:
+            continue
+        raise AssertionError(f"Tile inválido aceptado: {tile}")
+    print("Validación de tiles correcta.")
+
+if __name__ == '__main__':
+    # python image_metrics.py: comprobaciones de las métricas
+    validar_metricas()
+    validar_tile_stats()